@@ -1,17 +1,34 @@
 import streamlit as st
-import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.model_selection import train_test_split, GridSearchCV, TimeSeriesSplit
-from sklearn.feature_selection import mutual_info_regression, SelectKBest, f_regression
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import train_test_split, GridSearchCV, HalvingGridSearchCV, TimeSeriesSplit
+from sklearn.feature_selection import SelectKBest, f_regression
 from sklearn.svm import SVR
-from keras.models import Sequential
-from keras.layers import LSTM, Dense, Dropout
-from sklearn.metrics import mean_absolute_percentage_error, mean_squared_error
-import datetime
+from sklearn.metrics.pairwise import rbf_kernel
+from keras.models import Model
+from keras.layers import Input, LSTM, Dense, Dropout
+from keras.callbacks import EarlyStopping, ReduceLROnPlateau
+from keras.optimizers import Adam
+from keras import mixed_precision
+import tensorflow as tf
+from joblib import Parallel, delayed
 
+GPU_AVAILABLE = bool(tf.config.list_physical_devices('GPU'))
+
+# TimeSeriesSplit(n_splits=5) necesita al menos 2 filas por pliegue de validación para calcular el R²
+MIN_TRAIN_ROWS = 12
+
+
+# Función para descargar los datos históricos de Yahoo Finance
+@st.cache_data(ttl=3600)
+def load_data(ticker, start_date_timestamp, end_date_timestamp):
+    """
+    Descarga los precios históricos del ticker; el resultado se cachea por (ticker, inicio, fin).
+    """
+    url = f'https://query1.finance.yahoo.com/v7/finance/download/{ticker}?period1={start_date_timestamp}&period2={end_date_timestamp}&interval=1d&events=history&includeAdjustedClose=true'
+    return pd.read_csv(url)
 
 # Función para limpiar datos
 def clean_data(data):
@@ -24,18 +41,17 @@ def clean_data(data):
 # Función para normalizar datos
 def normalize_data(data):
     """
-    Normaliza los datos en el rango [0, 1].
+    Normaliza los datos en el rango [0, 1] y los devuelve en float32.
     """
     scaler = MinMaxScaler()
     data_scaled = scaler.fit_transform(data)
-    return pd.DataFrame(data_scaled, columns=data.columns), scaler
+    return pd.DataFrame(data_scaled.astype(np.float32), columns=data.columns), scaler
 
 # Función para seleccionar las mejores características
 def select_features(X, y, num_features):
     """
-    Selecciona las mejores características utilizando información mutua y la prueba F.
+    Selecciona las mejores características utilizando la prueba F.
     """
-    mutual_info = mutual_info_regression(X, y)
     k_best = SelectKBest(score_func=f_regression, k=num_features).fit(X, y)
     features = X.columns[k_best.get_support(indices=True)]
     return features.tolist()
@@ -45,54 +61,105 @@ def train_lstm(X_train, y_train, input_shape):
     """
     Entrena un modelo LSTM con los datos de entrenamiento.
     """
-    model = Sequential()
-    model.add(LSTM(units=50, return_sequences=True, input_shape=input_shape))
-    model.add(Dropout(0.2))
-    model.add(LSTM(units=50))
-    model.add(Dropout(0.2))
-    model.add(Dense(1))
-    model.compile(optimizer='adam', loss='mean_squared_error')
-    model.fit(X_train, y_train, epochs=500, batch_size=32, validation_split=0.2)
+    # Precisión mixta (float16) solo en las capas de este modelo y solo con GPU; en CPU float16 no acelera
+    dtype = 'mixed_float16' if GPU_AVAILABLE else 'float32'
+    inputs = Input(shape=input_shape)
+    x = LSTM(units=64, return_sequences=True, dtype=dtype)(inputs)
+    x = Dropout(0.2, dtype=dtype)(x)
+    x = LSTM(units=64, dtype=dtype)(x)
+    x = Dropout(0.2, dtype=dtype)(x)
+    # La capa de salida se mantiene en float32 para evitar desbordes con precisión mixta
+    outputs = Dense(1, dtype='float32')(x)
+    model = Model(inputs, outputs)
+    # Sin política global Keras no añade el escalado de pérdida: se envuelve el optimizador explícitamente
+    optimizer = mixed_precision.LossScaleOptimizer(Adam()) if GPU_AVAILABLE else 'adam'
+    model.compile(optimizer=optimizer, loss='mean_squared_error')
+    # Detener el entrenamiento cuando la pérdida de validación deja de mejorar (500 épocas es solo el tope)
+    callbacks = [
+        EarlyStopping(monitor='val_loss', patience=15, restore_best_weights=True),
+        ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=7),
+    ]
+    # tf.data no admite validation_split: se reserva el último 20% para validación, igual que Keras
+    y_train = np.asarray(y_train, dtype=np.float32)
+    split = int(len(X_train) * 0.8)
+    # cache() antes de shuffle() para conservar los tensores y aun así barajar en cada época
+    train_ds = (tf.data.Dataset.from_tensor_slices((X_train[:split], y_train[:split]))
+                .cache().shuffle(1024).batch(64).prefetch(tf.data.AUTOTUNE))
+    val_ds = (tf.data.Dataset.from_tensor_slices((X_train[split:], y_train[split:]))
+              .batch(64).cache().prefetch(tf.data.AUTOTUNE))
+    model.fit(train_ds, epochs=500, validation_data=val_ds, callbacks=callbacks, verbose=0)
     return model
 
 # Función para optimizar el modelo SVM
 def optimize_svm(X_train, y_train):
     """
-    Optimiza un modelo SVM utilizando GridSearchCV.
+    Optimiza un modelo SVM utilizando HalvingGridSearchCV (búsqueda por reducción sucesiva),
+    o GridSearchCV cuando hay pocas filas de entrenamiento.
+    La matriz de kernel RBF se calcula una sola vez por cada gamma y se reutiliza para todos los valores de C.
     """
     param_grid = {'C': [0.1, 1, 10], 'gamma': [1, 0.1, 0.01]}
-    grid = GridSearchCV(SVR(), param_grid, refit=True, cv=5)
-    grid.fit(X_train, y_train)
-    return grid.best_estimator_
+    # Validación cruzada temporal: cada pliegue solo valida sobre fechas posteriores a su entrenamiento
+    cv = TimeSeriesSplit(n_splits=5)
+    # La primera ronda de la reducción sucesiva valida con ~1/factor de cada pliegue; con menos de 2 filas
+    # el R² es NaN, así que solo se usa cuando cada pliegue tiene margen (3 filas tras el submuestreo)
+    factor = 3
+    fold_size = len(X_train) // (cv.get_n_splits() + 1)
+    use_halving = fold_size >= 3 * factor
+    # Si ninguna combinación obtiene una puntuación válida (NaN) se usa el SVR con parámetros por defecto
+    best_score, best_params = -np.inf, {}
+    for gamma in param_grid['gamma']:
+        kernel = rbf_kernel(X_train, gamma=gamma)
+        if use_halving:
+            grid = HalvingGridSearchCV(SVR(kernel='precomputed'), {'C': param_grid['C']}, factor=factor,
+                                       resource='n_samples', min_resources='exhaust', random_state=0,
+                                       refit=False, cv=cv, n_jobs=-1)
+        else:
+            grid = GridSearchCV(SVR(kernel='precomputed'), {'C': param_grid['C']}, refit=False, cv=cv, n_jobs=-1)
+        grid.fit(kernel, y_train)
+        if grid.best_score_ > best_score:
+            best_score, best_params = grid.best_score_, {**grid.best_params_, 'gamma': gamma}
+    # Ajuste final con los mejores parámetros y una caché de kernel más grande (en MB)
+    return SVR(**best_params, cache_size=500).fit(X_train, y_train)
+
+# Función para calcular las métricas de evaluación
+def compute_metrics(y_true, y_pred):
+    """
+    Calcula MAPE y RMSE en una sola pasada sobre los arrays.
+    """
+    y_true = np.asarray(y_true, dtype=np.float64)
+    error = y_true - np.asarray(y_pred, dtype=np.float64)
+    # Mismo denominador que sklearn para evitar divisiones por cero en valores normalizados
+    mape = np.mean(np.abs(error) / np.maximum(np.abs(y_true), np.finfo(np.float64).eps))
+    rmse = np.sqrt(np.mean(error * error))
+    return mape, rmse
 
 # Función para plotear las predicciones
 def plot_forecast(dates_test, y_test, svm_predictions, lstm_predictions, combined_predictions):
     """
-    Grafica las predicciones junto con los valores reales.
+    Grafica las predicciones junto con los valores reales (precio normalizado por fecha).
+    El gráfico se dibuja en el navegador con st.line_chart en lugar de renderizar una imagen en el servidor.
     """
-    fig, ax = plt.subplots(figsize=(12, 6))
-    ax.plot(dates_test, y_test, label='Precio Real')
-    ax.plot(dates_test, svm_predictions, label='Predicciones SVM')
-    ax.plot(dates_test, lstm_predictions, label='Predicciones LSTM')
-    ax.plot(dates_test, combined_predictions, label='Predicciones Combinadas')
-    ax.set_title('Predicción de Precios de Acciones')
-    ax.set_xlabel('Fecha')
-    ax.set_ylabel('Precio Normalizado')
-    ax.legend()
-    st.pyplot(fig)
-
-# Función para generar predicciones y métricas
-def generate_predictions(ticker, start_date, end_date):
+    chart_df = pd.DataFrame({'Precio Real': np.asarray(y_test),
+                             'Predicciones SVM': np.asarray(svm_predictions),
+                             'Predicciones LSTM': np.asarray(lstm_predictions),
+                             'Predicciones Combinadas': np.asarray(combined_predictions)},
+                            index=pd.to_datetime(np.asarray(dates_test)))
+    st.subheader('Predicción de Precios de Acciones')
+    st.line_chart(chart_df, x_label='Fecha', y_label='Precio Normalizado')
+
+# Función para preparar los datos y entrenar los modelos
+@st.cache_resource(ttl=3600, max_entries=8)
+def train_models(ticker, start_date, end_date):
     """
-    Genera predicciones utilizando modelos SVM y LSTM entrenados y devuelve métricas de evaluación.
+    Prepara los datos y entrena los modelos SVM y LSTM.
+    Los modelos se cachean por (ticker, inicio, fin) durante una hora, igual que los datos descargados.
     """
     # Convertir las fechas a timestamps
-    start_date_timestamp = int(datetime.datetime.combine(start_date, datetime.datetime.min.time()).timestamp())
-    end_date_timestamp = int(datetime.datetime.combine(end_date, datetime.datetime.min.time()).timestamp())
+    start_date_timestamp = int(pd.Timestamp(start_date).timestamp())
+    end_date_timestamp = int(pd.Timestamp(end_date).timestamp())
 
     # Cargar datos
-    url = f'https://query1.finance.yahoo.com/v7/finance/download/{ticker}?period1={start_date_timestamp}&period2={end_date_timestamp}&interval=1d&events=history&includeAdjustedClose=true'
-    data = pd.read_csv(url)
+    data = load_data(ticker, start_date_timestamp, end_date_timestamp)
 
     # Mantener la columna de fechas para las gráficas
     dates = data['Date']
@@ -118,27 +185,40 @@ def generate_predictions(ticker, start_date, end_date):
     X_train, X_test = X[:train_size], X[train_size:]
     y_train, y_test = y[:train_size], y[train_size:]
     dates_train, dates_test = dates[:train_size], dates[train_size:]
+    if len(X_train) < MIN_TRAIN_ROWS:
+        raise ValueError(f'El rango de fechas es demasiado corto: se necesitan al menos {MIN_TRAIN_ROWS} días de '
+                         f'entrenamiento y solo hay {len(X_train)}. Amplíe el rango de fechas.')
 
     # Reshape los datos para el modelo LSTM
-    X_train_lstm = X_train.values.reshape((X_train.shape[0], 1, X_train.shape[1]))
-    X_test_lstm = X_test.values.reshape((X_test.shape[0], 1, X_test.shape[1]))
+    # Un único buffer contiguo en float32 (requisito del kernel LSTM de cuDNN)
+    X_train_lstm = np.ascontiguousarray(X_train.to_numpy(dtype=np.float32))[:, None, :]
+    X_test_lstm = np.ascontiguousarray(X_test.to_numpy(dtype=np.float32))[:, None, :]
+
+    # Entrenar los modelos en paralelo (ambos liberan el GIL: libsvm y el runtime de TensorFlow)
+    svm_model, lstm_model = Parallel(n_jobs=2, backend='threading')([
+        delayed(optimize_svm)(X_train, y_train),
+        delayed(train_lstm)(X_train_lstm, y_train, (1, X_train.shape[1])),
+    ])
+
+    return svm_model, lstm_model, X_test, X_test_lstm, y_test, dates_test
 
-    # Entrenar los modelos
-    svm_model = optimize_svm(X_train, y_train)
-    lstm_model = train_lstm(X_train_lstm, y_train, (1, X_train.shape[1]))
+# Función para generar predicciones y métricas
+def generate_predictions(ticker, start_date, end_date):
+    """
+    Genera predicciones utilizando modelos SVM y LSTM entrenados y devuelve métricas de evaluación.
+    """
+    svm_model, lstm_model, X_test, X_test_lstm, y_test, dates_test = train_models(ticker, start_date, end_date)
 
-    # Generar predicciones
-    svm_predictions = pd.Series(svm_model.predict(X_test), index=X_test.index)
-    lstm_predictions = pd.Series(lstm_model.predict(X_test_lstm).flatten(), index=X_test.index)
-    combined_predictions = pd.Series(np.median([svm_predictions, lstm_predictions], axis=0), index=X_test.index)
+    # Generar predicciones (como arrays; el DataFrame se arma una sola vez al mostrarlas)
+    svm_predictions = svm_model.predict(X_test)
+    lstm_predictions = lstm_model.predict(X_test_lstm, batch_size=len(X_test_lstm), verbose=0).ravel()
+    # Con dos modelos la mediana coincide con la media
+    combined_predictions = 0.5 * (svm_predictions + lstm_predictions)
 
     # Calcular métricas de evaluación
-    mape_svm = mean_absolute_percentage_error(y_test, svm_predictions)
-    mape_lstm = mean_absolute_percentage_error(y_test, lstm_predictions)
-    mape_combined = mean_absolute_percentage_error(y_test, combined_predictions)
-    rmse_svm = np.sqrt(mean_squared_error(y_test, svm_predictions))
-    rmse_lstm = np.sqrt(mean_squared_error(y_test, lstm_predictions))
-    rmse_combined = np.sqrt(mean_squared_error(y_test, combined_predictions))
+    mape_svm, rmse_svm = compute_metrics(y_test, svm_predictions)
+    mape_lstm, rmse_lstm = compute_metrics(y_test, lstm_predictions)
+    mape_combined, rmse_combined = compute_metrics(y_test, combined_predictions)
 
     return (svm_predictions, lstm_predictions, combined_predictions,
             mape_svm, mape_lstm, mape_combined,
@@ -168,9 +248,13 @@ def mostrar_pagina_ensamblado():
 
     # Botón para ejecutar el análisis
     if st.button("Ejecutar Análisis"):
-        (svm_predictions, lstm_predictions, combined_predictions, mape_svm, 
-        mape_lstm, mape_combined, rmse_svm, rmse_lstm, rmse_combined, 
-        dates_test, y_test) = generate_predictions(ticker, start_date, end_date)
+        try:
+            (svm_predictions, lstm_predictions, combined_predictions, mape_svm, 
+            mape_lstm, mape_combined, rmse_svm, rmse_lstm, rmse_combined, 
+            dates_test, y_test) = generate_predictions(ticker, start_date, end_date)
+        except ValueError as error:
+            st.error(str(error))
+            return
 
         # Mostrar métricas de evaluación
         st.write("### Métricas de evaluación")
@@ -184,7 +268,8 @@ def mostrar_pagina_ensamblado():
         # Mostrar predicciones numéricas en un DataFrame
         st.write("### Predicciones numéricas")
         predictions_df = pd.DataFrame({'Actual': y_test, 'SVM Predicted': svm_predictions, 
-                                       'LSTM Predicted': lstm_predictions, 'Combined Predicted': combined_predictions})
+                                       'LSTM Predicted': lstm_predictions, 'Combined Predicted': combined_predictions},
+                                      index=y_test.index)
         st.dataframe(predictions_df)
 
         # Graficar las predicciones junto con los valores reales